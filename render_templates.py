@@ -1,14 +1,23 @@
 import argparse
+import functools
+import hashlib
+import itertools
 import os
+import pickle
 import yaml
 import shutil
 import logging
 import traceback
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import jinja2
 from jinja2 import (
+    ChoiceLoader,
     Environment,
     FileSystemLoader,
+    ModuleLoader,
     StrictUndefined,
     UndefinedError,
     TemplateSyntaxError,
@@ -16,83 +25,294 @@ from jinja2 import (
 )
 from glob import glob
 
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+BAR = "*" * 85
+BANNER = BAR + "\n%s\n" + BAR
+MANIFEST_NAME = ".rendered_manifest"
+
+# The umask can only be read by setting it, so do that once at import time
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 def deep_merge(dict1, dict2):
-    for key, value in dict2.items():
-        if key in dict1 and isinstance(dict1[key], dict) and isinstance(value, dict):
-            deep_merge(dict1[key], value)
-        else:
-            dict1[key] = value
+    # Explicit stack instead of recursion: no per-level frame cost and no RecursionError on deep trees
+    stack = [(dict1, dict2)]
+    while stack:
+        target, source = stack.pop()
+        for key, value in source.items():
+            current = target.get(key)
+            if isinstance(current, dict) and isinstance(value, dict):
+                stack.append((current, value))
+            else:
+                target[key] = value
 
 
-def load_yaml_files(file_paths):
-    merged = {}
+def load_yaml_file(path):
+    # Hand raw bytes to the loader; it detects the encoding itself, skipping a text-mode decode pass
+    return yaml.load(Path(path).read_bytes(), Loader=SafeLoader) or {}
+
+
+def fingerprint_files(file_paths, salt=""):
+    # Keyed on path, mtime and size so an unchanged tree is recognised without reading any file contents
+    digest = hashlib.blake2b(salt.encode(), digest_size=20)
     for path in file_paths:
-        with open(path, 'r') as f:
-            data = yaml.safe_load(f) or {}
-            deep_merge(merged, data)
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def load_yaml_files(file_paths):
+    if not file_paths:
+        return {}
+    merged = load_yaml_file(file_paths[0])  # The first file seeds the result as-is rather than being copied key by key
+    for path in file_paths[1:]:
+        deep_merge(merged, load_yaml_file(path))
+    return merged
+
+
+def load_values(core_yaml_files, env_yaml_files, cache_dir=None):
+    cache_path = None
+    if cache_dir:
+        # One cache file per pair of core/environment file sets, overwritten whenever any of the files changes
+        file_set = "\n".join(core_yaml_files) + "\n--\n" + "\n".join(env_yaml_files)
+        cache_path = os.path.join(cache_dir, f"{hashlib.blake2b(file_set.encode(), digest_size=20).hexdigest()}.pkl")
+        fingerprint = fingerprint_files(core_yaml_files + env_yaml_files, f"{yaml.__version__}:{len(core_yaml_files)}")
+        try:
+            with open(cache_path, "rb") as f:
+                cached_fingerprint, cached_values = pickle.load(f)
+            if cached_fingerprint == fingerprint:
+                return cached_values
+        except Exception:
+            pass  # A missing, corrupt or incompatible cache is simply rebuilt below
+
+    # Core and environment files are folded separately and then merged, so environment files override core as a group
+    merged = load_yaml_files(core_yaml_files)
+    deep_merge(merged, load_yaml_files(env_yaml_files))
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((fingerprint, merged), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
     return merged
 
 
-def render_templates(env, input_dir, output_dir, context):
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
-    os.makedirs(output_dir)
+def find_templates(root):
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name == "macros":
+                    continue  # Skip rendering macro files
+                yield from find_templates(entry.path)
+            elif entry.name.endswith(".j2"):
+                yield entry.path
+
+
+def build_environment(precompiled_dir=None):
+    loader = FileSystemLoader("terraform")
+    if precompiled_dir:
+        # Templates that failed to precompile fall through to the source loader so their errors still surface
+        loader = ChoiceLoader([ModuleLoader(precompiled_dir), loader])
+    return Environment(
+        loader=loader,
+        auto_reload=False,
+        cache_size=-1,  # Never evict: every template stays compiled for the life of the process
+        optimized=True,
+        undefined=StrictUndefined,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+
 
-    for path in Path(input_dir).rglob("*.j2"):
-        if "macros" in path.parts:
-            continue  # Skip rendering macro files
-        rel_path = path.relative_to(input_dir)
-        output_path = Path(output_dir) / rel_path.with_suffix("")
+def precompile_templates(template_dir, precompiled_dir):
+    template_files = []
+    for root, dirs, files in os.walk(template_dir):
+        dirs.sort()
+        template_files.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(".j2"))
+    fingerprint = fingerprint_files(template_files, jinja2.__version__)
 
-        os.makedirs(output_path.parent, exist_ok=True)
+    sentinel = os.path.join(precompiled_dir, ".fingerprint")
+    try:
+        with open(sentinel) as f:
+            if f.read() == fingerprint:
+                return False
+    except FileNotFoundError:
+        pass
 
+    if os.path.exists(precompiled_dir):
+        shutil.rmtree(precompiled_dir)
+    os.makedirs(precompiled_dir)
+    # Same as Environment.compile_templates, but a template that cannot be decoded is skipped instead of aborting the run
+    env = build_environment()
+    for name in env.list_templates(extensions=["j2"]):
         try:
-            template = env.get_template(rel_path.as_posix())
-            rendered = template.render(context)
-        except TemplateNotFound as e:
-            print("*************************************************************************************", file=sys.stderr)
-            print(f"[TEMPLATE NOT FOUND] Could not find template: {e.name}", file=sys.stderr)
-            print("*************************************************************************************", file=sys.stderr)
-            continue
-        except TemplateSyntaxError as e:
-            print("*************************************************************************************", file=sys.stderr)
-            print(f"[SYNTAX ERROR] In file '{e.filename}', line {e.lineno}: {e.message}", file=sys.stderr)
-            print("*************************************************************************************", file=sys.stderr)
-            continue
-        except UndefinedError as e:
-            print("*************************************************************************************", file=sys.stderr)
-            print(f"[MISSING VALUE] in file: [{rel_path}]. Likely missing variable in template.", file=sys.stderr)
-            print(f"Jinja2 error: {str(e)}", file=sys.stderr)
-            print("*************************************************************************************", file=sys.stderr)
-            continue
-        except Exception as e:
-            print("*************************************************************************************", file=sys.stderr)
-            print(f"[UNHANDLED ERROR] while rendering '{rel_path}': {e}", file=sys.stderr)
-            print("*************************************************************************************", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
+            source, filename, _ = env.loader.get_source(env, name)
+            code = env.compile(source, name, filename, raw=True, defer_init=True)
+        except (TemplateSyntaxError, UnicodeDecodeError):
+            continue  # Left to the source loader, which reports the error for this file when it is rendered
+        with open(os.path.join(precompiled_dir, ModuleLoader.get_module_filename(name)), "w", encoding="utf-8") as f:
+            f.write(code)
+    with open(sentinel, "w") as f:
+        f.write(fingerprint)
+    return True
+
+
+def write_file_if_changed(path, data):
+    # Leave identical files untouched so their mtimes don't change and Terraform has nothing new to pick up
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    # Single binary write to a uniquely named temp file, then atomically swap it in so a crash never leaves a partial file
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o666 & ~UMASK)  # mkstemp creates files 0600; match what a plain open() would produce
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def remove_stale_outputs(output_dir, expected_paths):
+    # Only files rendered by the previous run are candidates; Terraform state, lock files and anything else are left alone
+    output_root = os.path.normpath(output_dir)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            previous_paths = {os.path.normpath(os.path.join(output_dir, line)) for line in f.read().splitlines() if line}
+    except FileNotFoundError:
+        previous_paths = set()
+
+    for path in previous_paths - expected_paths:
+        if not path.startswith(output_root + os.sep):
             continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        # Prune directories the removal left empty, stopping at the first one that still holds anything
+        parent = os.path.dirname(path)
+        while parent != output_root:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    manifest = "".join(f"{os.path.relpath(path, output_dir).replace(os.sep, '/')}\n" for path in sorted(expected_paths))
+    write_file_if_changed(manifest_path, manifest.encode("utf-8"))
+
+
+# Per-process render state, set up once by _init_worker in each pool worker
+_worker_get_template = None
+
+
+def _init_worker(precompiled_dir, macros_dir, values):
+    global _worker_get_template
+    # Forked workers inherit the parent's handlers; workers report back through return values and never log
+    logging.getLogger().handlers.clear()
+    env = build_environment(precompiled_dir)
+    # Values and macros are invariant for the whole run, so expose them as globals instead of copying a context per render
+    env.globals.update(values)
+    # Macro load failures were already reported once by the parent, so workers stay quiet about them
+    inject_macros(env, macros_dir, env.globals)
+    # With auto_reload disabled the compiled template never changes, so skip the loader lookup on repeats
+    _worker_get_template = functools.lru_cache(maxsize=None)(env.get_template)
+
+
+# Runs inside a pool worker; returns (rel_path, output_path, changed, error_lines, traceback) for the parent to report
+def _render_one(rel_path, output_dir):
+    # Plain string handling keeps pathlib out of the per-file path; rel_path is posix-style and ends in ".j2"
+    output_path = os.path.normpath(os.path.join(output_dir, rel_path[:-3]))
+
+    try:
+        template = _worker_get_template(rel_path)
+        rendered = template.render()
+    except TemplateNotFound as e:
+        return rel_path, None, False, [f"[TEMPLATE NOT FOUND] Could not find template: {e.name}"], None
+    except TemplateSyntaxError as e:
+        return rel_path, None, False, [f"[SYNTAX ERROR] In file '{e.filename}', line {e.lineno}: {e.message}"], None
+    except UndefinedError as e:
+        return rel_path, None, False, [
+            f"[MISSING VALUE] in file: [{rel_path}]. Likely missing variable in template.",
+            f"Jinja2 error: {str(e)}",
+        ], None
+    except Exception as e:
+        return rel_path, None, False, [f"[UNHANDLED ERROR] while rendering '{rel_path}': {e}"], traceback.format_exc()
+
+    changed = write_file_if_changed(output_path, rendered.encode("utf-8"))
+    return rel_path, output_path, changed, None, None
+
 
-        with open(output_path, "w") as f:
-            f.write(rendered)
-        logging.info(f"Rendered: {rel_path} → {output_path}")
+def render_templates(input_dir, output_dir, values, macros_dir, precompiled_dir=None, max_workers=None):
+    os.makedirs(output_dir, exist_ok=True)
 
+    prefix_len = len(os.path.join(input_dir, ""))
+    rel_paths = [path[prefix_len:].replace(os.sep, "/") for path in find_templates(input_dir)]
+    # Create each output directory once up front rather than once per template in the workers
+    for rel_dir in {os.path.dirname(rel_path) for rel_path in rel_paths}:
+        os.makedirs(os.path.join(output_dir, rel_dir), exist_ok=True)
 
+    # Load the macros once here so a broken macro is reported once, not once per worker
+    for macro_file, e, tb in inject_macros(build_environment(precompiled_dir), macros_dir, {}):
+        logging.error("[MACRO LOAD ERROR] Failed to load macro '%s': %s\n%s", macro_file, e, tb.rstrip())
+
+    expected_paths = set()
+    if rel_paths:
+        max_workers = min(max_workers or os.cpu_count() or 1, len(rel_paths))
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(precompiled_dir, macros_dir, values),
+        ) as executor:
+            results = executor.map(
+                _render_one,
+                rel_paths,
+                itertools.repeat(output_dir),
+                chunksize=16,
+            )
+            for rel_path, output_path, changed, error_lines, tb in results:
+                if error_lines:
+                    logging.error(BANNER + "%s", "\n".join(error_lines), f"\n{tb.rstrip()}" if tb else "")
+                    continue
+                expected_paths.add(output_path)
+                if changed:
+                    logging.info("Rendered: %s → %s", rel_path, output_path)
+                else:
+                    logging.info("Unchanged: %s → %s", rel_path, output_path)
+
+    # Outputs of templates that were removed or failed to render this run are deleted, as a full rebuild would
+    remove_stale_outputs(output_dir, expected_paths)
+
+
+# Returns (macro_file, exception, traceback) for each macro that failed to load so the caller decides how to report it
 def inject_macros(env, macros_dir, context):
+    errors = []
     if not os.path.isdir(macros_dir):
-        return
+        return errors
     loader_root = "terraform"
 
     for macro_file in sorted(Path(macros_dir).glob("*.j2")):
         try:
             macro_template = env.get_template(macro_file.relative_to(loader_root).as_posix())
             macro_module = macro_template.module
-            for name in dir(macro_module):
+            for name, value in vars(macro_module).items():
                 if not name.startswith("_"):
-                    context[name] = getattr(macro_module, name)
+                    context[name] = value
         except Exception as e:
-            print(f"[MACRO LOAD ERROR] Failed to load macro '{macro_file}': {e}", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
+            errors.append((macro_file, e, traceback.format_exc()))
+    return errors
 
 
 def main():
@@ -104,8 +324,14 @@ def main():
     parser.add_argument("--macros_dir", default="terraform/macros", help="Directory containing Jinja2 macros")
     parser.add_argument("--output_yaml", default=".output/.rendered/combined.yaml", help="Path to save combined YAML file")
     parser.add_argument("--output_dir", default=".output/.terraform_rendered", help="Directory to save rendered templates")
+    parser.add_argument("--precompiled_dir", default=".jinja_precompiled", help="Directory to store ahead-of-time compiled templates")
+    parser.add_argument("--yaml_cache_dir", default=".yaml_cache", help="Directory to cache merged YAML values between runs")
+    parser.add_argument("--workers", type=int, default=None, help="Number of render processes (default: CPU count)")
 
     args = parser.parse_args()
+
+    if not yaml.__with_libyaml__:
+        logging.warning("PyYAML was built without libyaml; falling back to the pure-Python YAML loader")
     print("\n\n")
     print("     ██╗██╗███╗   ██╗     ██╗ █████╗ ██████╗ ████████╗███████╗██████╗ ██████╗  █████╗ ███████╗ ██████╗ ██████╗ ███╗   ███╗   ")
     print("     ██║██║████╗  ██║     ██║██╔══██╗╚════██╗╚══██╔══╝██╔════╝██╔══██╗██╔══██╗██╔══██╗██╔════╝██╔═══██╗██╔══██╗████╗ ████║   ")
@@ -115,53 +341,54 @@ def main():
     print(" ╚════╝ ╚═╝╚═╝  ╚═══╝ ╚════╝ ╚═╝  ╚═╝╚══════╝   ╚═╝   ╚══════╝╚═╝  ╚═╝╚═╝  ╚═╝╚═╝  ╚═╝╚═╝      ╚═════╝ ╚═╝  ╚═╝╚═╝     ╚═╝   \n\n")
 
 
+    if not os.path.isdir(args.target_files):
+        logging.error("Target files directory does not exist: %s", args.target_files)
+        sys.exit(1)
+
     env_files = f"environments/{args.environment}"
     if not os.path.isdir(env_files):
-        print(f"[ERROR] Target template directory does not exist: {env_files}", file=sys.stderr)
+        logging.error("Target template directory does not exist: %s", env_files)
         sys.exit(1)
 
     logging.info("Get Core yaml files [environments]")
     core_yaml_files = sorted(glob(os.path.join("environments", "*.yml")) + glob(os.path.join("environments", "*.yaml")))
     if not core_yaml_files:
-        print(f"[ERROR] No YAML files found in environments/", file=sys.stderr)
+        logging.error("No YAML files found in environments/")
         sys.exit(1)
 
-    logging.info(f"Get Envionment yaml files[{env_files}]")
+    logging.info("Get Envionment yaml files[%s]", env_files)
     env_yaml_files = sorted(glob(os.path.join(env_files, "*.yml")) + glob(os.path.join(env_files, "*.yaml")))
     if not env_yaml_files:
-        print(f"[ERROR] No YAML files found in {env_files}", file=sys.stderr)
+        logging.error("No YAML files found in %s", env_files)
         sys.exit(1)
 
-    logging.info(f"Target Environment Set [{args.environment}] [{env_files}]")
+    logging.info("Target Environment Set [%s] [%s]", args.environment, env_files)
 
-    logging.info(f"Loading [{core_yaml_files}] [{env_yaml_files}]")
-    core_values = load_yaml_files(core_yaml_files)
-    env_values = load_yaml_files(env_yaml_files)
-
-    logging.info(f"Merging...")
-    deep_merge(core_values, env_values)
+    logging.info("Loading [%s] [%s]", core_yaml_files, env_yaml_files)
+    core_values = load_values(core_yaml_files, env_yaml_files, args.yaml_cache_dir)
 
     with open(args.output_yaml, "w") as f:
-        yaml.dump(core_values, f, sort_keys=False)
-    logging.info(f"Combined YAML written to [{args.output_yaml}]")
+        yaml.dump(core_values, f, Dumper=SafeDumper, sort_keys=False)
+    logging.info("Combined YAML written to [%s]", args.output_yaml)
 
-    env = Environment(
-        loader=FileSystemLoader("terraform"),
-        undefined=StrictUndefined,
-        trim_blocks=True,
-        lstrip_blocks=True,
-    )
+    if precompile_templates("terraform", args.precompiled_dir):
+        logging.info("Precompiled templates to [%s]", args.precompiled_dir)
 
-    inject_macros(env, args.macros_dir, core_values)
-    print("*************************************************************************************")
-    logging.info(f"Rendering templates from [{args.target_files}]")
-    print("*************************************************************************************")
-    render_templates(env, args.target_files, args.output_dir, core_values)
-    print("*************************************************************************************")
-    logging.info(f"Rendered yaml saved to       [{args.output_yaml}]")
-    logging.info(f"Rendered templates saved to  [{args.output_dir}]")
-    print("*************************************************************************************")
-    print("Everything is Awesome! \n\n")
+    logging.info(BANNER % "Rendering templates from [%s]", args.target_files)
+    render_templates(
+        args.target_files,
+        args.output_dir,
+        core_values,
+        args.macros_dir,
+        precompiled_dir=args.precompiled_dir,
+        max_workers=args.workers,
+    )
+    logging.info(
+        BANNER % "Rendered yaml saved to       [%s]\nRendered templates saved to  [%s]",
+        args.output_yaml,
+        args.output_dir,
+    )
+    logging.info("Everything is Awesome!")
 
 
 if __name__ == "__main__":